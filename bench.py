@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ============================================================
+#     缔造者时间同步系统 · 离线仿真 / 基准测试
+# ============================================================
+#
+#   虚拟时钟 + 假时间源 + 假 Telegram 客户端，确定性地驱动
+#   telegram.py 的 get_cloud_time / update_loop / strip_old，
+#   输出触发误差分位数、漏更/重复分钟、每小时调用量与 CPU。
+#
+#   python3 bench.py --hours 24 --accounts 10 --alpha 0.25
+#   python3 bench.py --trace trace.json --json
+
+import io
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import selectors
+import contextlib
+from types import SimpleNamespace
+from collections import Counter
+
+from telethon import errors
+
+import telegram as tg
+
+
+# ------------------------------------------------------------
+#               虚拟时钟事件循环
+# ------------------------------------------------------------
+class _VirtualSelector(selectors.SelectSelector):
+    """
+    没有真实 IO：select 的超时直接推进虚拟时间
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    TICK = 5e-6   # 每轮循环的固定开销，保证逐次让出的忙等也能推进时间
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("仿真停滞：没有任何待触发的定时器")
+        self.now += max(timeout, self.TICK)
+        return []
+
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self):
+        super().__init__(_VirtualSelector())
+
+    def time(self):
+        return self._selector.now
+
+
+class VirtualTime:
+    """
+    替换 telegram.time：本地 monotonic = 虚拟循环时间（带频偏），
+    本地墙上时间带固定误差；true_ms() 为真实时间
+    """
+
+    def __init__(self, loop, epoch, drift_ppm, wall_error_ms):
+        self.loop = loop
+        self.epoch = epoch
+        self.rate = 1 + drift_ppm * 1e-6
+        self.wall_error = wall_error_ms / 1000
+
+    def true_ms(self):
+        return (self.epoch + self.loop.time() / self.rate) * 1000
+
+    def monotonic(self):
+        return self.loop.time()
+
+    perf_counter = monotonic
+
+    def time(self):
+        return self.true_ms() / 1000 + self.wall_error
+
+    def tzset(self):
+        pass
+
+
+# ------------------------------------------------------------
+#               假时间源（回放 RTT / 偏差轨迹）
+# ------------------------------------------------------------
+DEFAULT_SOURCES = [
+    {"name": "taobao", "bias_ms": 0, "rtt_ms": 40, "jitter_ms": 15, "loss": 0.01},
+    {"name": "jd", "bias_ms": 5, "rtt_ms": 60, "jitter_ms": 30, "loss": 0.02},
+    {"name": "ntp", "bias_ms": 0, "rtt_ms": 30, "jitter_ms": 5, "loss": 0.01,
+     "weight": 1.5, "precision": 0.5},
+]
+
+
+class FakeTimeServer:
+    """
+    rtts 给定则循环回放，否则按 rtt_ms ± jitter_ms 随机生成；
+    offsets 给定则循环回放服务器时间偏差（可模拟跳变 / 漂移的源），
+    否则固定为 bias_ms；asym 为去程占 RTT 的比例（非对称路由会造成系统误差）
+    """
+
+    def __init__(self, vt, rng, name, bias_ms=0, rtt_ms=40, jitter_ms=10,
+                 loss=0.0, spike=0.0, asym=0.5, rtts=None, offsets=None, **_):
+        self.vt = vt
+        self.rng = rng
+        self.name = name
+        self.bias = bias_ms
+        self.rtt = rtt_ms
+        self.jitter = jitter_ms
+        self.loss = loss
+        self.spike = spike
+        self.asym = asym
+        self.rtts = rtts
+        self.offsets = offsets
+        self.calls = 0
+
+    def next_rtt(self):
+        if self.rtts:
+            return self.rtts[(self.calls - 1) % len(self.rtts)]
+        rtt = self.rtt + abs(self.rng.gauss(0, self.jitter))
+        if self.rng.random() < self.spike:
+            rtt *= 10
+        return rtt
+
+    def next_offset(self):
+        if self.offsets:
+            return self.offsets[(self.calls - 1) % len(self.offsets)]
+        return self.bias
+
+    async def __call__(self):
+        self.calls += 1
+        if self.rng.random() < self.loss:
+            await asyncio.sleep(60)
+
+        rtt = self.next_rtt()
+        offset = self.next_offset()
+        t1 = tg.mono_ms()
+        await asyncio.sleep(rtt * self.asym / 1000)
+        ts = self.vt.true_ms() + offset
+        await asyncio.sleep(rtt * (1 - self.asym) / 1000)
+        t2 = tg.mono_ms()
+        return ts, (t1 + t2) / 2, t2 - t1
+
+
+# ------------------------------------------------------------
+#               假 Telegram 客户端（记录请求时刻）
+# ------------------------------------------------------------
+class StubClient:
+
+    def __init__(self, vt, rng, name, rpc_ms, rpc_jitter_ms, flood_per_hour=0):
+        self.vt = vt
+        self.rng = rng
+        self.first_name = name
+        self.rpc_ms = rpc_ms
+        self.rpc_jitter = rpc_jitter_ms
+        self.flood_per_hour = flood_per_hour   # 服务器限额，0 = 不限
+        self.calls = Counter()
+        self.applied = []    # (服务器生效的真实毫秒, 新名字)
+        self.floods = 0
+
+    async def _one_way(self):
+        await asyncio.sleep(
+            (self.rpc_ms + abs(self.rng.gauss(0, self.rpc_jitter))) / 2000
+        )
+
+    async def get_me(self):
+        self.calls["GetUsersRequest"] += 1
+        await self._one_way()
+        me = SimpleNamespace(id=1, first_name=self.first_name)
+        await self._one_way()
+        return me
+
+    def _flood_wait(self, now):
+        """
+        滑动一小时窗口超过限额则返回需要等待的秒数
+        """
+        if not self.flood_per_hour:
+            return 0
+        recent = [t for t, _ in self.applied if now - t < 3600000]
+        if len(recent) < self.flood_per_hour:
+            return 0
+        return int((recent[0] + 3600000 - now) / 1000) + 1
+
+    async def __call__(self, req):
+        self.calls[type(req).__name__] += 1
+        await self._one_way()
+        if not hasattr(req, "first_name"):    # PingRequest 等探测
+            await self._one_way()
+            return
+        wait = self._flood_wait(self.vt.true_ms())
+        if wait:
+            self.floods += 1
+            await self._one_way()
+            raise errors.FloodWaitError(req, capture=wait)
+        if req.first_name is not None:
+            self.first_name = req.first_name
+            self.applied.append((self.vt.true_ms(), req.first_name))
+        await self._one_way()
+
+    def add_event_handler(self, *args, **kwargs):
+        pass
+
+
+# ------------------------------------------------------------
+#               统计
+# ------------------------------------------------------------
+STAMP_RE = re.compile(r"(\d{4}-\d\d-\d\d \d\d:\d\d)")
+
+
+def percentile(xs, p):
+    if not xs:
+        return float("nan")
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def analyse(clients, start_ms, end_ms):
+    errors, missed, dup, stacked = [], 0, 0, 0
+
+    first = (int(start_ms) // 60000 + 2) * 60000   # 第一个完整可更新分钟
+    minutes = range(first, int(end_ms) - 60000, 60000)
+
+    for c in clients:
+        seen = Counter()
+        for applied, name in c.applied:
+            stamps = STAMP_RE.findall(name)
+            stacked += len(stamps) > 1
+            shown = time.strptime(stamps[-1], "%Y-%m-%d %H:%M")
+            target = time.mktime(shown) * 1000
+            seen[target] += 1
+            errors.append(applied - target)
+
+        for m in minutes:
+            missed += seen[m] == 0
+            dup += max(seen[m] - 1, 0)
+
+    return {
+        "updates": sum(len(c.applied) for c in clients),
+        "trigger_error_ms": dict(
+            {f"p{p}": round(percentile(errors, p), 2) for p in (1, 50, 90, 99)},
+            max_abs=round(max(map(abs, errors), default=0), 2)
+        ),
+        "missed_minutes": missed,
+        "duplicate_minutes": dup,
+        "stacked_names": stacked,
+    }
+
+
+# ------------------------------------------------------------
+#               仿真主流程
+# ------------------------------------------------------------
+async def simulate(args, vt, rng):
+
+    servers = [
+        FakeTimeServer(vt, rng, **cfg) for cfg in load_sources(args.trace)
+    ]
+    tg.TIME_SOURCES.clear()
+    for s, cfg in zip(servers, load_sources(args.trace)):
+        tg.register_source(
+            s.name, s, cfg.get("weight", 1.0), cfg.get("precision", 1.0)
+        )
+    tg.clock = tg.CloudClock()
+    tg.sampler = tg.TimeSampler()
+
+    # get_cloud_time 首次校准精度
+    first = await tg.get_cloud_time()
+    first_err = first.timestamp() * 1000 - vt.true_ms()
+
+    clients = [
+        StubClient(vt, rng, f"User{i}", args.rpc_ms, args.rpc_jitter_ms,
+                   args.flood_per_hour)
+        for i in range(args.accounts)
+    ]
+    accounts = [tg.Account(f"sim{i}", c) for i, c in enumerate(clients)]
+    for acc in accounts:
+        await acc.learn_profile()
+
+    start_ms = vt.true_ms()
+    cpu0 = time.process_time()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        task = asyncio.create_task(tg.update_loop(accounts))
+        await asyncio.sleep(args.hours * 3600)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    cpu = time.process_time() - cpu0
+    end_ms = vt.true_ms()
+    clock_err = tg.clock.now_ms() - end_ms
+
+    report = analyse(clients, start_ms, end_ms)
+    rpc = sum((c.calls for c in clients), Counter())
+    report.update({
+        "hours": args.hours,
+        "accounts": args.accounts,
+        "alpha": tg.ALPHA,
+        "presend": tg.PRESEND,
+        "first_sync_error_ms": round(first_err, 2),
+        "final_clock_error_ms": round(clock_err, 2),
+        "drift_estimate_ppm": round(tg.clock.drift * 1e6, 2),
+        "http_calls_per_hour": {
+            s.name: round(s.calls / args.hours, 1) for s in servers
+        },
+        "rpc_calls_per_hour": {
+            k: round(v / args.hours, 1) for k, v in rpc.items()
+        },
+        "floodwaits": sum(c.floods for c in clients),
+        "cpu_seconds_per_hour": round(cpu / args.hours, 4),
+    })
+    return report
+
+
+def load_sources(path):
+    if not path:
+        return DEFAULT_SOURCES
+    return json.load(open(path, "r"))
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    loop = VirtualLoop()
+
+    # 起点随机落在某分钟内，避免总是对齐整分
+    epoch = 1763640000 + rng.uniform(0, 60)
+    vt = VirtualTime(loop, epoch, args.drift_ppm, args.wall_error_ms)
+
+    saved = tg.time, tg.ALPHA, tg.PRESEND, tg.TARGET_OFFSET_MS, tg.clock, tg.sampler
+    sources = dict(tg.TIME_SOURCES)
+    tg.time = vt
+    if args.alpha is not None:
+        tg.ALPHA = args.alpha
+    tg.PRESEND = args.presend
+    tg.TARGET_OFFSET_MS = args.target_offset_ms
+    try:
+        return loop.run_until_complete(simulate(args, vt, rng))
+    finally:
+        tg.time, tg.ALPHA, tg.PRESEND, tg.TARGET_OFFSET_MS, tg.clock, tg.sampler = saved
+        tg.TIME_SOURCES.clear()
+        tg.TIME_SOURCES.update(sources)
+        loop.close()
+
+
+def print_report(r):
+    print("\n====== 缔造者时间同步系统 · 仿真报告 ======\n")
+    print(f"⏱ 仿真时长：{r['hours']} 小时 × {r['accounts']} 个账号"
+          f"（ALPHA={r['alpha']}，预发送={'开' if r['presend'] else '关'}）")
+    print(f"✨ 更新次数：{r['updates']}")
+    e = r["trigger_error_ms"]
+    print(f"🎯 生效时刻 - 整分（毫秒）：p1={e['p1']} p50={e['p50']} "
+          f"p90={e['p90']} p99={e['p99']} max|·|={e['max_abs']}")
+    print(f"❌ 漏更分钟：{r['missed_minutes']}   🔁 重复分钟：{r['duplicate_minutes']}"
+          f"   🧱 时间叠加：{r['stacked_names']}   ⏸ FloodWait：{r['floodwaits']}")
+    print(f"🕰 首次校准误差：{r['first_sync_error_ms']} ms   "
+          f"结束时钟误差：{r['final_clock_error_ms']} ms   "
+          f"漂移估计：{r['drift_estimate_ppm']} ppm")
+    print(f"🌐 时间源调用/小时：{r['http_calls_per_hour']}")
+    print(f"📡 RPC 调用/小时：{r['rpc_calls_per_hour']}")
+    print(f"🧮 CPU 秒/小时：{r['cpu_seconds_per_hour']}\n")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="缔造者时间同步系统 离线仿真")
+    p.add_argument("--hours", type=float, default=6)
+    p.add_argument("--accounts", type=int, default=1)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--alpha", type=float, default=None, help="覆盖 ALPHA 平滑系数")
+    p.add_argument("--drift-ppm", type=float, default=20, help="本地时钟频偏")
+    p.add_argument("--wall-error-ms", type=float, default=3000, help="本地墙上时间误差")
+    p.add_argument("--rpc-ms", type=float, default=80, help="MTProto RTT")
+    p.add_argument("--rpc-jitter-ms", type=float, default=20)
+    p.add_argument("--presend", action="store_true", help="开启延迟补偿预发送")
+    p.add_argument("--target-offset-ms", type=float, default=0)
+    p.add_argument("--flood-per-hour", type=int, default=0,
+                   help="模拟服务器每小时更新限额，超过即 FloodWait")
+    p.add_argument("--trace", help="时间源配置 JSON（列表，字段同 DEFAULT_SOURCES，可含 rtts / offsets）")
+    p.add_argument("--json", action="store_true", help="输出 JSON")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
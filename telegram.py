@@ -11,14 +11,30 @@ import json
 import asyncio
 import logging
 import re
+import struct
+import socket
+import random
 import aiohttp
+from aiohttp import web
 import time
-from datetime import datetime, timedelta
+import multiprocessing
+from collections import deque
+from statistics import median
 
-from telethon import TelegramClient, errors
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:      # Python 3.8
+    ZoneInfo = None
+from datetime import datetime
+
+from telethon import TelegramClient, errors, events
 from telethon.sessions import StringSession
-from telethon.network.connection import ConnectionTcpFull
+from telethon.network.connection import (
+    ConnectionTcpFull, ConnectionTcpIntermediate, ConnectionTcpAbridged
+)
+from telethon.tl.functions import PingRequest
 from telethon.tl.functions.account import UpdateProfileRequest
+from telethon.tl.types import UpdateUser, UpdateUserName
 
 # ------------------------------------------------------------
 #                强制系统时区为北京时间
@@ -30,75 +46,454 @@ except:
     pass
 
 # ------------------------------------------------------------
-#        Cloud-Time API（主源：淘宝 / 备源：京东）
+#        Cloud-Time API（淘宝 / 京东 / HTTP Date / NTP）
 # ------------------------------------------------------------
 API_TAOBAO = "http://api.m.taobao.com/rest/api3.do?api=mtop.common.getTimestamp"
 API_JD     = "https://api.m.jd.com/client.action?functionId=queryMaterialProducts&client=wh5"
+API_DATE   = "https://www.baidu.com/"
+NTP_HOST   = "ntp.aliyun.com"
+NTP_PORT   = 123
 
 # ============================================================
-#     ★ Ultra-Time 超级精准时间获取（核心升级）
+#     ★ Ultra-Time 时钟驯服引擎（稀疏采样 + 偏移/漂移估计）
 # ============================================================
+#
+#   云端时间 ≈ monotonic + offset + drift × (monotonic - ref)
+#
+#   只在校准时访问时间 API，其余时间全部由本地 monotonic
+#   推算；每分钟的更新由 loop.call_at 精确定时触发，不再轮询。
 
-last_good_ts = None      # 真实毫秒时间缓存
-smooth_ts = None         # 平滑时间链
 ALPHA = 0.25             # 平滑系数（越小越稳定）
+MAX_DRIFT = 500e-6       # 漂移上限（±500 ppm）
+SYNC_FAST = 30           # 未收敛时的校准间隔（秒）
+SYNC_INTERVAL = 600      # 收敛后的校准间隔（秒）
+SYNC_CONVERGED = 4       # 连续几次采样与预测吻合（误差界内）视为收敛
+STEP_MS = 128            # 偏差超过此值直接跳变，不再慢慢平滑
+STATE_MAX_AGE = 86400    # 保存的时钟状态多久内可用于热启动（秒）
+
+
+def mono_ms():
+    return time.monotonic() * 1000
+
+
+class CloudClock:
+
+    def __init__(self, state_path=None):
+        self.offset = None   # 云端毫秒 - monotonic 毫秒（ref 时刻）
+        self.ref = None      # 最近一次校准的 monotonic 毫秒
+        self.drift = 0.0     # 本地时钟相对云端的频率误差
+        self.samples = 0     # 成功校准次数
+        self.agreed = 0      # 连续与预测吻合的采样次数
+        self.failures = 0    # 连续失败次数（保持模式）
+        self.state_path = state_path
+
+    @property
+    def synced(self):
+        return self.offset is not None
+
+    @property
+    def converged(self):
+        return self.agreed >= SYNC_CONVERGED
+
+    def offset_at(self, m):
+        return self.offset + self.drift * (m - self.ref)
+
+    def now_ms(self):
+        m = mono_ms()
+        if self.offset is None:
+            return time.time() * 1000
+        return m + self.offset_at(m)
+
+    def feed(self, cloud_ms, m, bound=0.0):
+        """
+        输入一次采样：云端毫秒时间 cloud_ms 对应本地 monotonic 毫秒 m，
+        bound 为该次采样的综合误差界（毫秒）
+        """
+        off = cloud_ms - m
+        self.samples += 1
+        self.failures = 0
+
+        if self.offset is None:
+            self.offset, self.ref = off, m
+            return
+
+        dt = m - self.ref
+        predicted = self.offset_at(m)
+        err = off - predicted
+
+        # 收敛看残差：偏差落在采样自身误差界内才算吻合
+        self.agreed = self.agreed + 1 if abs(err) <= 2 * bound else 0
+
+        # 偏差超出误差界能解释的范围（热启动后宿主机调过时间等）：直接跳变；
+        # 门限随误差界放大，低精度采样（如 http_date 的 ±500ms）只平滑
+        if abs(err) > max(STEP_MS, 3 * bound):
+            self.offset, self.ref = off, m
+            metrics.observe("tg_clock_correction_ms", err)
+            return
+
+        # 频率增益取 ALPHA²/2（临界阻尼），与 ALPHA 同量级会振荡；
+        # 间隔要长到误差界带来的单次漂移噪声远小于漂移上限
+        gain = ALPHA ** 2 / 2
+        if dt >= 1000 and gain * bound / dt < MAX_DRIFT / 10:
+            self.drift += gain * err / dt
+            self.drift = max(-MAX_DRIFT, min(MAX_DRIFT, self.drift))
+
+        self.offset = predicted + ALPHA * err
+        self.ref = m
+
+        metrics.observe("tg_clock_correction_ms", ALPHA * err)
+        metrics.set("tg_clock_drift_ppm", round(self.drift * 1e6, 3))
+
+    async def sample(self):
+        """
+        多源并发采样，结果送入驯服引擎
+        """
+        r = await sampler.sample(self)
+
+        # ====== 完全失败：保持模式，继续按 offset + drift 走时 ======
+        if r is None:
+            self.failures += 1
+            metrics.inc("tg_clock_holdover_total")
+            return False
+
+        off, m, bound = r
+        self.feed(m + off, m, bound)
+        metrics.set("tg_clock_offset_ms", round(self.now_ms() - time.time() * 1000, 3))
+        self.save_state()
+        return True
+
+    def save_state(self):
+        """
+        以墙上时间为基准保存偏移 / 漂移 / 源质量，重启后可热启动
+        """
+        if not self.state_path or not self.synced:
+            return
+        state = {
+            "wall_offset": self.now_ms() - time.time() * 1000,
+            "drift": self.drift,
+            "samples": self.samples,
+            "quality": sampler.quality,
+            "saved_at": time.time(),
+        }
+        try:
+            tmp = self.state_path + ".tmp"
+            json.dump(state, open(tmp, "w"), indent=2)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            log.warning(f"保存时钟状态失败：{e}")
+
+    def load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return False
+        try:
+            state = json.load(open(self.state_path, "r"))
+        except (OSError, ValueError):
+            return False
+
+        age = time.time() - state["saved_at"]
+        if not 0 <= age <= STATE_MAX_AGE:
+            return False
+
+        # 停机期间墙上时间按原频偏继续漂移
+        wall_offset = state["wall_offset"] + state["drift"] * age * 1000
+        m = mono_ms()
+        self.offset = time.time() * 1000 + wall_offset - m
+        self.ref = m
+        self.drift = state["drift"]
+
+        # 保留一次快采样确认，不直接视为已收敛
+        self.samples = state["samples"]
+        self.agreed = min(self.samples, SYNC_CONVERGED - 1)
+        sampler.quality.update(state.get("quality", {}))
+        return True
+
+    async def sync_loop(self):
+        """
+        后台校准：未收敛时快采样，收敛后每 10 分钟一次
+        """
+        while True:
+            fast = not self.converged or self.failures
+            await asyncio.sleep(SYNC_FAST if fast else SYNC_INTERVAL)
+            await self.sample()
+
+    async def sleep_until(self, target_ms):
+        """
+        用 loop.call_at 精确睡到云端时间 target_ms
+        """
+        loop = asyncio.get_running_loop()
+        delay = (target_ms - self.now_ms()) / 1000
+        if delay <= 0:
+            return
+
+        fut = loop.create_future()
+        handle = loop.call_at(
+            loop.time() + delay,
+            lambda: fut.done() or fut.set_result(None)
+        )
+        try:
+            await fut
+        finally:
+            handle.cancel()
+
+
+clock = CloudClock()
 
 
 async def get_cloud_time():
     """
-    双源获取时间 + RTT 半程延迟补偿 + 平滑算法（Ultra-Time）
+    兼容旧接口：采样一次并返回当前云端时间
     """
-    global last_good_ts, smooth_ts
+    await clock.sample()
+    return datetime.fromtimestamp(clock.now_ms() / 1000)
 
-    ts_list = []
 
-    # ====== 双源采样 ======
-    for api in (API_TAOBAO, API_JD):
-        try:
-            t1 = time.perf_counter()
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(api, timeout=1.5) as resp:
-                    data = await resp.json()
+# ============================================================
+#     ★ 多源时间采样器（连接池 + 并发 + NTP 式时钟滤波）
+# ============================================================
+#
+#   每个源一次请求返回 (云端毫秒, 对应的 monotonic 毫秒, RTT)。
+#   所有源并发采样，共用一个 keep-alive 连接池；每个源保留
+#   最近几次样本取最小 RTT，跨源剔除离群后按质量加权。
 
-            t2 = time.perf_counter()
-            rtt = (t2 - t1) * 1000 / 2     # 单边 RTT
+SAMPLE_TIMEOUT = 1.5     # 单源超时（秒）
+FILTER_DEPTH = 8         # 每源保留样本数（时钟滤波窗口）
+OUTLIER_MS = 50          # 离群判定下限（毫秒）
 
-            # 淘宝格式
-            if "data" in data and "t" in data["data"]:
-                ts = int(data["data"]["t"]) + rtt
+_http = None
 
-            # 京东格式
-            elif "currentTime2" in data:
-                ts = int(data["currentTime2"]) + rtt
 
-            else:
+async def http_session():
+    """
+    全局共享的 keep-alive 连接池，避免每次采样重复 TCP+TLS 握手；
+    空闲保活时间长于校准间隔，收敛后的稀疏采样也能复用连接
+    """
+    global _http
+    if _http is None or _http.closed:
+        trace = aiohttp.TraceConfig()
+        trace.on_request_headers_sent.append(_on_headers_sent)
+        _http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=16,
+                ttl_dns_cache=3600,
+                keepalive_timeout=SYNC_INTERVAL + 60
+            ),
+            timeout=aiohttp.ClientTimeout(total=SAMPLE_TIMEOUT),
+            trace_configs=[trace]
+        )
+    return _http
+
+
+async def _on_headers_sent(session, ctx, params):
+    # 连接已就绪、请求刚发出才开始计时：RTT 不含 DNS / TCP / TLS 握手
+    ctx.trace_request_ctx["t1"] = mono_ms()
+
+
+async def close_http():
+    global _http
+    if _http is not None:
+        await _http.close()
+        _http = None
+
+
+async def _http_get(url):
+    session = await http_session()
+    timing = {}
+    async with session.get(url, trace_request_ctx=timing) as resp:
+        t2 = mono_ms()
+        data = await resp.json(content_type=None)
+    return data, timing["t1"], t2
+
+
+# ====== 淘宝 ======
+async def source_taobao():
+    data, t1, t2 = await _http_get(API_TAOBAO)
+    return int(data["data"]["t"]), (t1 + t2) / 2, t2 - t1
+
+
+# ====== 京东 ======
+async def source_jd():
+    data, t1, t2 = await _http_get(API_JD)
+    return int(data["currentTime2"]), (t1 + t2) / 2, t2 - t1
+
+
+# ====== HTTP Date 头（秒级，取区间中点）======
+async def source_http_date():
+    session = await http_session()
+    timing = {}
+    async with session.head(API_DATE, trace_request_ctx=timing) as resp:
+        t2 = mono_ms()
+        t1 = timing["t1"]
+        date = resp.headers["Date"]
+    ts = datetime.strptime(date, "%a, %d %b %Y %H:%M:%S GMT")
+    ts = (ts - datetime(1970, 1, 1)).total_seconds() * 1000 + 500
+    return ts, (t1 + t2) / 2, t2 - t1
+
+
+# ====== SNTP（UDP，一次往返）======
+NTP_EPOCH = 2208988800
+_ntp_addr = None
+
+
+class _SNTPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, fut):
+        self.fut = fut
+
+    def datagram_received(self, data, addr):
+        if not self.fut.done():
+            self.fut.set_result((data, mono_ms()))
+
+    def error_received(self, exc):
+        if not self.fut.done():
+            self.fut.set_exception(exc)
+
+
+def _ntp_check(data, origin):
+    """
+    校验 SNTP 应答（RFC 4330）：服务器模式、LI 未告警、stratum 1-15
+    （0 为 Kiss-o'-Death）、发送时间戳非零、originate 回显本次请求
+    """
+    if len(data) < 48:
+        raise ValueError("SNTP 应答过短")
+    li, mode, stratum = data[0] >> 6, data[0] & 7, data[1]
+    if mode != 4 or li == 3 or not 1 <= stratum <= 15:
+        raise ValueError(f"SNTP 应答无效：LI={li} mode={mode} stratum={stratum}")
+    if data[24:32] != origin or not any(data[40:48]):
+        raise ValueError("SNTP 应答时间戳无效")
+
+
+def _ntp_ms(data, i):
+    sec, frac = struct.unpack("!II", data[i:i + 8])
+    return (sec - NTP_EPOCH) * 1000 + frac * 1000 / 2 ** 32
+
+
+async def source_ntp():
+    global _ntp_addr
+    loop = asyncio.get_running_loop()
+
+    if _ntp_addr is None:
+        info = await loop.getaddrinfo(
+            NTP_HOST, NTP_PORT, family=socket.AF_INET, type=socket.SOCK_DGRAM
+        )
+        _ntp_addr = info[0][4]
+
+    fut = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _SNTPProtocol(fut), remote_addr=_ntp_addr
+    )
+    # 发送时间戳填随机数，服务器须原样回显在 originate 字段
+    origin = os.urandom(8)
+    try:
+        t1 = mono_ms()
+        transport.sendto(b"\x1b" + b"\0" * 39 + origin)
+        data, t4 = await fut
+    finally:
+        transport.close()
+
+    _ntp_check(data, origin)
+
+    recv, xmit = _ntp_ms(data, 32), _ntp_ms(data, 40)
+    rtt = (t4 - t1) - (xmit - recv)
+    return (recv + xmit) / 2, (t1 + t4) / 2, rtt
+
+
+# ====== 源注册表：名称 -> (采样函数, 质量权重, 固有精度毫秒) ======
+TIME_SOURCES = {}
+
+def register_source(name, fn, weight=1.0, precision=1.0):
+    TIME_SOURCES[name] = (fn, weight, precision)
+
+register_source("taobao", source_taobao, weight=1.0, precision=1.0)
+register_source("jd", source_jd, weight=1.0, precision=1.0)
+register_source("ntp", source_ntp, weight=1.5, precision=0.5)
+register_source("http_date", source_http_date, weight=0.3, precision=500.0)
+
+
+class TimeSampler:
+
+    def __init__(self):
+        self.history = {}    # 源 -> deque[(offset, monotonic, rtt)]
+        self.quality = {}    # 源 -> 成功率 EMA
+
+    async def _probe(self, name, fn):
+        try:
+            r = await asyncio.wait_for(fn(), SAMPLE_TIMEOUT)
+        except Exception:
+            metrics.inc("tg_time_source_errors_total", source=name)
+            return name, None
+        metrics.observe("tg_time_source_rtt_ms", r[2], source=name)
+        return name, r
+
+    async def sample(self, clock):
+        """
+        并发采样全部源，返回 (offset, monotonic 毫秒, 综合误差界)；全部失败返回 None
+        """
+        results = await asyncio.gather(
+            *(self._probe(n, e[0]) for n, e in TIME_SOURCES.items())
+        )
+        now = mono_ms()
+        drift = clock.drift if clock.synced else 0.0
+
+        cands = []
+        for name, r in results:
+            q = self.quality.get(name, 1.0)
+
+            if r is None:
+                self.quality[name] = (1 - ALPHA) * q
                 continue
+            self.quality[name] = (1 - ALPHA) * q + ALPHA
 
-            ts_list.append(ts)
+            cloud, mid, rtt = r
+            hist = self.history.setdefault(name, deque(maxlen=FILTER_DEPTH))
+            hist.append((cloud - mid, mid, max(rtt, 0.0)))
 
-        except:
-            continue
+            # 时钟滤波：最小 RTT 样本最可信，按漂移外推到当前
+            best = min(hist, key=lambda h: h[2])
+            off, m, rtt = best
+            off += drift * (now - m)
 
-    # ====== 判断是否完全失败 ======
-    if not ts_list:
-        if last_good_ts:
-            last_good_ts += 250     # 回退链向前推进
-            return datetime.fromtimestamp(last_good_ts / 1000)
-        return datetime.now()
+            _, weight, precision = TIME_SOURCES[name]
+            err = rtt / 2 + precision
+            cands.append((off, err, weight * self.quality[name], name, best))
 
-    # ====== 多点采样取平均 ======
-    raw_ts = sum(ts_list) / len(ts_list)
+        if not cands:
+            return None
 
-    # ====== 平滑算法 ======
-    if smooth_ts is None:
-        smooth_ts = raw_ts
-    else:
-        smooth_ts = ALPHA * raw_ts + (1 - ALPHA) * smooth_ts
+        # ====== 离群剔除（参照 ± max(3·MAD, 50ms) + 源自身误差）======
+        # 候选不足 3 个时中位数分不出谁对谁错，改以本地当前预测为参照
+        arbiter = len(cands) >= 3 or not clock.synced
+        if arbiter:
+            ref = median(c[0] for c in cands)
+            mad = median(abs(c[0] - ref) for c in cands)
+        else:
+            ref, mad = clock.offset_at(now), 0.0
+        limit = max(3 * mad, OUTLIER_MS)
+        kept = [c for c in cands if abs(c[0] - ref) <= limit + c[1]]
+
+        if kept:
+            # 被剔除的样本移出滤波窗口，免得坏样本靠最小 RTT 反复入选
+            for c in cands:
+                if c not in kept:
+                    self.history[c[3]].remove(c[4])
+        else:
+            kept = cands
 
-    last_good_ts = smooth_ts
+        # ====== 按 质量 / 误差 加权 ======
+        ws = [c[2] / c[1] for c in kept]
+        off = sum(c[0] * w for c, w in zip(kept, ws)) / sum(ws)
+        bound = sum(c[1] * w for c, w in zip(kept, ws)) / sum(ws)
 
-    return datetime.fromtimestamp(smooth_ts / 1000)
+        # 误差界计入保留候选之间的分歧；没有第三方裁决又与本地预测
+        # 对不上时，分歧同样计入，交给 feed 只平滑、不跳变
+        bound = max([bound] + [abs(c[0] - off) for c in kept])
+        if not arbiter and abs(off - ref) > limit + bound:
+            bound = abs(off - ref)
+        metrics.set("tg_clock_error_bound_ms", round(bound, 3))
+        return off, now, bound
+
+
+sampler = TimeSampler()
 
 
 
@@ -113,46 +508,322 @@ logging.basicConfig(
 log = logging.getLogger("dizaozhe")
 
 
+
+# ============================================================
+#     ★ 运行指标（Prometheus /metrics + 周期 JSON 日志）
+# ============================================================
+METRICS_HOST = os.environ.get("TG_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("TG_METRICS_PORT", "0"))     # 0 = 不开端口
+METRICS_LOG = int(os.environ.get("TG_METRICS_LOG", "300"))     # 秒，0 = 不输出
+
+RTT_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+ERR_BUCKETS = (-1000, -250, -100, -50, -20, -10, -5, -1,
+               1, 5, 10, 20, 50, 100, 250, 1000)
+
+# 名称 -> (类型, 说明, 直方图分桶)
+METRIC_DEFS = {
+    "tg_time_source_rtt_ms":       ("histogram", "时间源 RTT（毫秒）", RTT_BUCKETS),
+    "tg_time_source_errors_total": ("counter", "时间源采样失败次数", None),
+    "tg_clock_correction_ms":      ("histogram", "每次校准施加的偏移修正（毫秒）", ERR_BUCKETS),
+    "tg_clock_offset_ms":          ("gauge", "云端时间 - 本地墙上时间（毫秒）", None),
+    "tg_clock_drift_ppm":          ("gauge", "本地时钟频偏估计（ppm）", None),
+    "tg_clock_error_bound_ms":     ("gauge", "最近一次多源采样的综合误差界（毫秒）", None),
+    "tg_clock_holdover_total":     ("counter", "全部源失败、按本地推算走时的次数", None),
+    "tg_update_latency_ms":        ("histogram", "UpdateProfileRequest 往返耗时（毫秒）", RTT_BUCKETS),
+    "tg_updates_total":            ("counter", "昵称更新次数（按结果）", None),
+    "tg_trigger_error_ms":         ("histogram", "实际发送时刻 - 计划触发时刻（毫秒）", ERR_BUCKETS),
+    "tg_floodwait_total":          ("counter", "FloodWait 次数", None),
+    "tg_floodwait_seconds_total":  ("counter", "FloodWait 累计等待秒数", None),
+    "tg_dc_rtt_ms":                ("gauge", "各 DC 地址 TCP 建连 RTT（毫秒）", None),
+    "tg_heartbeat_failures_total": ("counter", "触发前心跳失败次数", None),
+    "tg_reconnects_total":         ("counter", "后台重连次数（按结果）", None),
+}
+
+
+class Metrics:
+
+    def __init__(self):
+        self.values = {}     # (名称, 标签) -> 数值 或 直方图 [各桶, sum, count]
+
+    def _key(self, name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, n=1, **labels):
+        k = self._key(name, labels)
+        self.values[k] = self.values.get(k, 0) + n
+
+    def set(self, name, value, **labels):
+        self.values[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        buckets = METRIC_DEFS[name][2]
+        k = self._key(name, labels)
+        h = self.values.get(k)
+        if h is None:
+            h = self.values[k] = [0] * len(buckets) + [0.0, 0]
+        for i, b in enumerate(buckets):
+            if value <= b:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+    def render(self):
+        """
+        Prometheus 文本格式（0.0.4）
+        """
+        lines = []
+        for name, (kind, help_, buckets) in METRIC_DEFS.items():
+            series = [(k[1], v) for k, v in self.values.items() if k[0] == name]
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, v in sorted(series):
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {v}")
+                    continue
+                for b, c in zip(buckets, v):
+                    lines.append(f"{name}_bucket{_labels(labels, le=b)} {c}")
+                lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {v[-1]}')
+                lines.append(f"{name}_sum{_labels(labels)} {v[-2]}")
+                lines.append(f"{name}_count{_labels(labels)} {v[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        JSON 日志用：直方图只输出 count / 平均值
+        """
+        out = {}
+        for (name, labels), v in sorted(self.values.items()):
+            key = name + "".join(f".{lv}" for _, lv in labels)
+            if isinstance(v, list):
+                out[key] = {"count": v[-1], "avg": round(v[-2] / v[-1], 2) if v[-1] else 0}
+            else:
+                out[key] = round(v, 3)
+        return out
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+metrics = Metrics()
+
+
+async def start_metrics_server(port):
+    async def handle(request):
+        return web.Response(
+            text=metrics.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    print(f"📈 指标端点：http://{METRICS_HOST}:{port}/metrics\n")
+    return runner
+
+
+async def metrics_log_loop():
+    while True:
+        await asyncio.sleep(METRICS_LOG)
+        log.info(json.dumps({"metrics": metrics.snapshot()}, ensure_ascii=False))
+
+
 # ------------------------------------------------------------
-#               ★ 强制使用 DC4（删除 DC2）★
+#     ★ 连接管理（测速选 DC + 轻量传输 + 心跳 + 后台重连）★
 # ------------------------------------------------------------
-DC4_IP = "149.154.167.91"
-DC4_PORT = 443
+#
+#   已登录的会话只能连自己的主 DC，在它的 IPv4 / IPv6 地址里
+#   测速选最快；新绑定时可在全部 DC 中测速（Telegram 会按手机号
+#   自动迁移）。触发前十几秒发心跳，异常交给后台重连，重连在
+#   触发前完成，更新路径永远不承担建连成本。
+
+DC_ADDRESSES = {
+    1: ("149.154.175.53", "2001:b28:f23d:f001::a"),
+    2: ("149.154.167.51", "2001:67c:4e8:f002::a"),
+    3: ("149.154.175.100", "2001:b28:f23d:f003::a"),
+    4: ("149.154.167.91", "2001:67c:4e8:f004::a"),
+    5: ("91.108.56.130", "2001:b28:f23f:f005::a"),
+}
+DC_PORT = 443
+DC_CHOICE = os.environ.get("TG_DC", "auto")          # auto = 测速；数字 = 新绑定固定该 DC
+
+TRANSPORTS = {
+    "full": ConnectionTcpFull,
+    "intermediate": ConnectionTcpIntermediate,
+    "abridged": ConnectionTcpAbridged,
+}
+TRANSPORT = TRANSPORTS[os.environ.get("TG_TRANSPORT", "full")]
+
+DC_PROBE_ROUNDS = 3        # 每个地址测几次取最小
+DC_PROBE_TIMEOUT = 3       # 单次 TCP 建连超时（秒）
+HEARTBEAT_LEAD_MS = 15000  # 触发前多久发心跳（超时 + 重连都要在触发前完成）
+HEARTBEAT_TIMEOUT = 5      # 心跳超时（秒）
+SUPERVISE_INTERVAL = 10    # 连接巡检间隔（秒）
+RECONNECT_MIN = 1          # 重连退避起点（秒）
+RECONNECT_MAX = 60         # 重连退避上限（秒）
+
+_dc_probes = {}            # 地址 -> 测速任务，结果为 TCP 建连 RTT（毫秒），None = 不可达
+
+
+async def probe_tcp(ip):
+    best = None
+    for _ in range(DC_PROBE_ROUNDS):
+        try:
+            t1 = mono_ms()
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, DC_PORT), DC_PROBE_TIMEOUT
+            )
+            rtt = mono_ms() - t1
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            continue
+        best = rtt if best is None else min(best, rtt)
+    return best
 
-class ForceDC4(ConnectionTcpFull):
-    host = DC4_IP
-    port = DC4_PORT
+
+async def probe_addresses(ips):
+    """
+    测速结果进程内缓存，多账号共用；进行中的测速同样共享，
+    并发连接的一批账号只测一次
+    """
+    for ip in ips:
+        if ip not in _dc_probes:
+            _dc_probes[ip] = asyncio.ensure_future(probe_tcp(ip))
+
+    # shield：某个账号被取消不影响其他账号共用的测速
+    rtts = await asyncio.gather(*(asyncio.shield(_dc_probes[ip]) for ip in ips))
+    return dict(zip(ips, rtts))
+
+
+async def pick_address(dc_id):
+    """
+    返回 (dc_id, 地址)：已有会话限定主 DC，新会话按 TG_DC 选择
+    """
+    if dc_id:
+        dcs = [dc_id]
+    elif DC_CHOICE != "auto":
+        dcs = [int(DC_CHOICE)]
+    else:
+        dcs = list(DC_ADDRESSES)
+
+    candidates = [(dc, ip) for dc in dcs for ip in DC_ADDRESSES.get(dc, ())]
+    if not candidates:
+        return None
+
+    rtts = await probe_addresses([ip for _, ip in candidates])
+    reachable = []
+    for dc, ip in candidates:
+        if rtts[ip] is not None:
+            metrics.set("tg_dc_rtt_ms", round(rtts[ip], 2), dc=dc, ip=ip)
+            reachable.append((rtts[ip], dc, ip))
+
+    if not reachable:
+        return dcs[0], DC_ADDRESSES[dcs[0]][0]
+    _, dc, ip = min(reachable)
+    return dc, ip
+
+
+async def open_client(cfg):
+    session = StringSession(cfg.get("session"))
+
+    picked = await pick_address(session.dc_id)
+    if picked:
+        session.set_dc(picked[0], picked[1], DC_PORT)
+
+    return TelegramClient(
+        session,
+        cfg["api_id"],
+        cfg["api_hash"],
+        connection=TRANSPORT,
+        use_ipv6=":" in (session.server_address or "")
+    )
 
 
 
 # ------------------------------------------------------------
 #               账号文件
 # ------------------------------------------------------------
-ACC_FILE = "account.json"
+ACC_FILE = os.environ.get("TG_ACCOUNT_FILE", "account.json")
+ACC_DIR = os.environ.get("TG_ACCOUNTS_DIR", "accounts")   # 多账号目录
+
+# 无头模式：不读标准输入（systemd / nohup 下 stdin 不是终端时自动开启）
+HEADLESS = os.environ.get("TG_HEADLESS", "") == "1" or (
+    os.environ.get("TG_HEADLESS", "") != "0" and not sys.stdin.isatty()
+)
 
-def save_acc(session, api_id, api_hash):
+def save_acc(session, api_id, api_hash, path=ACC_FILE):
     json.dump(
         {"session": session, "api_id": api_id, "api_hash": api_hash},
-        open(ACC_FILE, "w"),
+        open(path, "w"),
         indent=2,
         ensure_ascii=False
     )
 
-def load_acc():
-    if os.path.exists(ACC_FILE):
-        return json.load(open(ACC_FILE, "r"))
+def load_acc(path=ACC_FILE):
+    if os.path.exists(path):
+        return json.load(open(path, "r"))
     return None
 
+def env_acc():
+    """
+    TG_SESSION + TG_API_ID + TG_API_HASH 直接给出账号，无需 account.json
+    """
+    session = os.environ.get("TG_SESSION")
+    api_id = os.environ.get("TG_API_ID")
+    api_hash = os.environ.get("TG_API_HASH")
+    if session and api_id and api_hash:
+        return {"session": session, "api_id": int(api_id), "api_hash": api_hash}
+    return None
+
+def clock_state_path(shard=0):
+    """
+    时钟状态与会话文件放在一起，分片进程各用一份
+    """
+    base = os.path.dirname(os.path.abspath(ACC_FILE))
+    name = "clock.json" if not shard else f"clock.{shard}.json"
+    return os.path.join(base, name)
+
+def load_accounts():
+    """
+    多账号目录：每个 *.json 一个账号（格式同 account.json），按文件名排序
+    """
+    if not os.path.isdir(ACC_DIR):
+        return []
+    return [
+        (f[:-5], load_acc(os.path.join(ACC_DIR, f)))
+        for f in sorted(os.listdir(ACC_DIR))
+        if f.endswith(".json")
+    ]
+
 
 
 # ------------------------------------------------------------
-#         ★ 中文账号登录流程（强制提示 + DC4）★
+#         ★ 中文账号登录流程（强制提示 + 测速选 DC）★
 # ------------------------------------------------------------
 async def login_process():
 
     print("\n====== 缔造者时间同步系统 ======\n")
 
-    cfg = load_acc()
+    cfg = env_acc() or load_acc()
+
+    if HEADLESS:
+        if not cfg:
+            raise SystemExit(
+                "❌ 无头模式需要 account.json 或 TG_SESSION / TG_API_ID / TG_API_HASH，"
+                "请先在终端运行一次完成绑定"
+            )
+        print("🤖 无头模式：使用现有账号配置\n")
+        client = await open_client(cfg)
+        await client.connect()
+        return client
+
     if cfg:
         print("检测到已有账号配置：")
         print(f"API_ID   ：{cfg['api_id']}")
@@ -162,24 +833,26 @@ async def login_process():
 
         c = input("请选择 1 或 2： ").strip()
         if c == "1":
-            client = TelegramClient(
-                StringSession(cfg["session"]),
-                cfg["api_id"],
-                cfg["api_hash"],
-                connection=ForceDC4
-            )
+            client = await open_client(cfg)
             await client.connect()
             return client
-        
+
         print("⚠️ 重新绑定，将删除旧配置\n")
-        os.remove(ACC_FILE)
+        if os.path.exists(ACC_FILE):
+            os.remove(ACC_FILE)
+
+    client = await bind_account(ACC_FILE)
+    return client
+
+
+async def bind_account(path):
 
     # 绑定新账号
-    api_id = int(input("🔢 API_ID： "))
-    api_hash = input("🧬 API_HASH： ")
+    api_id = int(os.environ.get("TG_API_ID") or input("🔢 API_ID： "))
+    api_hash = os.environ.get("TG_API_HASH") or input("🧬 API_HASH： ")
     phone = input("📱 手机号（例如 +86138xxxxxx）： ")
 
-    client = TelegramClient(StringSession(), api_id, api_hash, connection=ForceDC4)
+    client = await open_client({"api_id": api_id, "api_hash": api_hash})
     await client.connect()
 
     print("⏳ 正在发送验证码…")
@@ -193,12 +866,334 @@ async def login_process():
         pwd = input("🔒 二步验证密码： ")
         await client.sign_in(password=pwd)
 
-    save_acc(client.session.save(), api_id, api_hash)
+    save_acc(client.session.save(), api_id, api_hash, path)
     print("🎉 账号绑定成功！\n")
 
     return client
 
 
+async def add_account():
+    """
+    python3 telegram.py add —— 绑定新账号到多账号目录
+    """
+    os.makedirs(ACC_DIR, exist_ok=True)
+    name = input("🏷 账号名称（文件名）： ").strip()
+    client = await bind_account(os.path.join(ACC_DIR, f"{name}.json"))
+    await client.disconnect()
+
+
+
+# ------------------------------------------------------------
+#         ★ FloodWait 自适应限速（每账号令牌桶）★
+# ------------------------------------------------------------
+#
+#   令牌按学到的最小间隔补充，每次更新消耗一个；FloodWait 时
+#   记录惩罚截止时刻并加倍间隔，惩罚期内的分钟直接跳过（合并
+#   到下一次），到期后在下一个整分恢复；连续成功再逐步收紧。
+
+GOV_MIN_INTERVAL = 60      # 正常节奏：每分钟一次（秒）
+GOV_MAX_INTERVAL = 3600    # 间隔上限（秒）
+GOV_RECOVER = 30           # 连续成功多少次后收紧一档
+GOV_RECOVER_FACTOR = 0.8   # 每档收紧比例
+
+
+class RateGovernor:
+
+    def __init__(self):
+        self.interval = GOV_MIN_INTERVAL   # 学到的最小更新间隔（秒）
+        self.tokens = 1.0
+        self.stamp = None                  # 上次补充令牌的目标分钟（毫秒）
+        self.penalty_until = 0             # FloodWait 截止（云端毫秒）
+        self.streak = 0                    # 连续成功次数
+
+    def allow(self, fire_ms, target_ms):
+        """
+        本分钟是否发送；惩罚期内或令牌不足则跳过
+        """
+        if fire_ms < self.penalty_until:
+            return False
+
+        if self.stamp is not None:
+            self.tokens += (target_ms - self.stamp) / (self.interval * 1000)
+            self.tokens = min(self.tokens, 1.0)
+        self.stamp = target_ms
+
+        # 浮点误差容忍
+        if self.tokens < 1 - 1e-6:
+            return False
+        self.tokens -= 1
+        return True
+
+    def on_success(self):
+        self.streak += 1
+        if self.streak >= GOV_RECOVER and self.interval > GOV_MIN_INTERVAL:
+            self.interval = max(GOV_MIN_INTERVAL, self.interval * GOV_RECOVER_FACTOR)
+            self.streak = 0
+
+    def on_flood(self, seconds, now_ms):
+        self.penalty_until = now_ms + seconds * 1000
+        self.interval = min(GOV_MAX_INTERVAL, self.interval * 2)
+        self.streak = 0
+
+        # 惩罚期本身就是等待：到期后的第一个整分立即放行
+        self.tokens = 1.0
+        self.stamp = None
+
+
+
+
+# ------------------------------------------------------------
+#         ★ 延迟补偿预发送（新名字恰好在整分生效）★
+# ------------------------------------------------------------
+#
+#   在现有连接上用 PingRequest 持续测量 MTProto RTT，发送时刻
+#   = 目标时刻 - 单程延迟；请求体提前序列化，触发时只剩发送。
+
+PRESEND = os.environ.get("TG_PRESEND", "0") == "1"
+TARGET_OFFSET_MS = float(os.environ.get("TG_TARGET_OFFSET_MS", "0"))  # 相对整分的生效时刻
+PRECISION_MS = float(os.environ.get("TG_PRECISION_MS", "5"))          # 最后一段改为逐次让出精确对时
+PROBE_INTERVAL = 20      # RTT 探测间隔（秒）
+PROBE_WINDOW = 16        # 保留最近多少个 RTT 样本
+
+
+class RttEstimator:
+
+    def __init__(self):
+        self.samples = deque(maxlen=PROBE_WINDOW)
+
+    def add(self, rtt):
+        self.samples.append(rtt)
+
+    def one_way(self):
+        """
+        取低分位 RTT 的一半：排队尖峰只会让 RTT 变大，不代表常态
+        """
+        if not self.samples:
+            return 0.0
+        xs = sorted(self.samples)
+        return xs[len(xs) // 4] / 2
+
+
+def prebuild(req):
+    """
+    提前序列化：Telethon 发送时调用 bytes(req)，直接返回缓存
+    """
+    raw = bytes(req)
+    req._bytes = lambda: raw
+    return req
+
+
+async def probe_rtt(acc):
+    t1 = mono_ms()
+    await acc.client(PingRequest(ping_id=random.getrandbits(63)))
+    acc.rtt.add(mono_ms() - t1)
+
+
+async def probe_loop(acc):
+    while True:
+        try:
+            await probe_rtt(acc)
+        except Exception:
+            pass
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def sleep_precise(target_ms):
+    """
+    call_at 睡到 target - PRECISION_MS，剩余部分逐次让出循环检查
+    """
+    await clock.sleep_until(target_ms - PRECISION_MS)
+    while clock.now_ms() < target_ms:
+        await asyncio.sleep(0)
+
+
+
+# ------------------------------------------------------------
+#         ★ 多账号引擎（共享时钟 + 同一分钟节拍）★
+# ------------------------------------------------------------
+CONCURRENCY = int(os.environ.get("TG_CONCURRENCY", "32"))  # 同时在途的更新数
+WORKERS = int(os.environ.get("TG_WORKERS", "1"))            # 0 = 按 CPU 数分片
+RECONCILE_MIN = 30   # 每隔多少分钟用 get_me 兜底校对一次原名
+
+
+class Account:
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.user_id = None
+        self.bases = {}      # 字段 -> 去掉模板部分后的原文（缓存）
+        self.shown = {}      # 字段 -> 服务器上当前的值
+        self.renders = {}    # 字段 -> 最近几次自己渲染发出的值
+        self.target = None   # 已预渲染的目标分钟
+        self.pending = None  # 预渲染好的下一分钟请求（无变化则为 None）
+        self.governor = RateGovernor()
+        self.rtt = RttEstimator()
+        self.unhealthy = asyncio.Event()   # 心跳失败，通知后台重连
+
+        # FloodWait 交给限速器处理，Telethon 不要在请求里自行 sleep
+        client.flood_sleep_threshold = 0
+
+    async def learn_profile(self):
+        """
+        get_me 学习原名；之后靠 UpdateUserName 事件保持最新
+        """
+        me = await self.client.get_me()
+        self.user_id = me.id
+        self.set_profile(me.first_name, getattr(me, "last_name", None))
+        return me
+
+    def set_profile(self, first_name, last_name):
+        for field, value in (("first_name", first_name), ("last_name", last_name)):
+            value = value or ""
+            self.shown[field] = value
+            if field in TEMPLATES:
+                base = TEMPLATES[field].base_of(value)
+
+                # 对不上模板：是自己刚发出的值则保留缓存的原名，
+                # 否则视为手动改名，按 strip_old 学习新原名
+                if base is None and value in self.renders.get(field, ()):
+                    base = self.bases.get(field)
+                if base is None:
+                    base = strip_old(value)
+                self.bases[field] = base
+
+        # 等待期间名字被改：按新原名重新渲染
+        if self.target is not None:
+            self.prepare(self.target)
+
+    def watch_profile(self):
+        self.client.add_event_handler(
+            self.on_user_update, events.Raw(types=(UpdateUser, UpdateUserName))
+        )
+
+    async def on_user_update(self, update):
+        if update.user_id != self.user_id:
+            return
+        if isinstance(update, UpdateUserName):
+            self.set_profile(update.first_name, update.last_name)
+        else:
+            # UpdateUser 不带名字，重新拉取一次
+            await self.learn_profile()
+
+    def prepare(self, target_ms):
+        """
+        渲染全部模板字段，只把有变化的字段放进同一个请求
+        """
+        self.target = target_ms
+        changed = {}
+        for field, tpl in TEMPLATES.items():
+            value = tpl.render(self.bases.get(field, ""), target_ms)
+            if self.shown.get(field) != value:
+                changed[field] = value
+                self.renders.setdefault(field, deque(maxlen=4)).append(value)
+
+        self.pending = prebuild(UpdateProfileRequest(**changed)) if changed else None
+
+    async def heartbeat(self):
+        """
+        触发前的心跳：顺带刷新 RTT，失败则交给 supervise 重连
+        """
+        try:
+            await asyncio.wait_for(probe_rtt(self), HEARTBEAT_TIMEOUT)
+        except Exception:
+            metrics.inc("tg_heartbeat_failures_total")
+            self.unhealthy.set()
+
+    def dispatch_at(self, fire_ms, target_ms):
+        """
+        预发送模式：目标时刻减去单程延迟；否则按第 59 秒触发
+        """
+        if PRESEND:
+            return target_ms + TARGET_OFFSET_MS - self.rtt.one_way()
+        return fire_ms
+
+
+async def connect_account(name, cfg):
+    try:
+        client = await open_client(cfg)
+        await client.connect()
+        if not await client.is_user_authorized():
+            print(f"❌ [{name}] 会话已失效，跳过")
+            await client.disconnect()
+            return None
+    except Exception as e:
+        print(f"❌ [{name}] 连接失败：{e}")
+        return None
+    return Account(name, client)
+
+
+async def connect_accounts(items):
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(name, cfg):
+        async with sem:
+            return await connect_account(name, cfg)
+
+    accounts = await asyncio.gather(*(one(n, c) for n, c in items))
+    return [a for a in accounts if a]
+
+
+async def supervise(acc):
+    """
+    后台连接守护：巡检 / 心跳失败时断开重连，指数退避
+    """
+    while True:
+        try:
+            await asyncio.wait_for(acc.unhealthy.wait(), SUPERVISE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        if not acc.unhealthy.is_set() and acc.client.is_connected():
+            continue
+
+        acc.unhealthy.clear()
+        print(f"🔌 [{acc.name}] 连接异常，后台重连…")
+
+        delay = RECONNECT_MIN
+        while True:
+            try:
+                await acc.client.disconnect()
+                await acc.client.connect()
+                metrics.inc("tg_reconnects_total", result="ok")
+                break
+            except Exception as e:
+                metrics.inc("tg_reconnects_total", result="error")
+                print(f"❌ [{acc.name}] 重连失败：{e}，{delay:.0f} 秒后重试")
+                await asyncio.sleep(delay * (1 + random.random() * 0.2))
+                delay = min(delay * 2, RECONNECT_MAX)
+
+        # 重连后拉一次资料，顺便恢复更新推送
+        try:
+            await acc.learn_profile()
+        except Exception:
+            pass
+        print(f"✅ [{acc.name}] 已重新连接")
+
+
+def shard_count(n):
+    workers = WORKERS or os.cpu_count() or 1
+    return max(1, min(workers, n))
+
+
+def run_shard(items, shard):
+    asyncio.run(main(items, shard))
+
+
+def run_sharded(items, workers):
+    """
+    按 CPU 将账号分片到多个进程，每个进程一个时钟 + 一个事件循环
+    """
+    print(f"🧩 {len(items)} 个账号分片到 {workers} 个进程\n")
+    procs = [
+        multiprocessing.Process(target=run_shard, args=(items[i::workers], i))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+
 
 # ------------------------------------------------------------
 #               24 时钟图标
@@ -227,59 +1222,385 @@ def strip_old(name):
 
 
 # ============================================================
-#     ★ 59 秒更新下一分钟（绝对精准，不偏差）
+#     ★ 多字段模板（名 / 姓 / 简介，差量合并更新）
 # ============================================================
-async def update_loop(client):
+#
+#   占位符：{base} 原名（仅名 / 姓）、{time:格式}、{time@时区:格式}、
+#           {clock}、{clock@时区}；模板为空表示不管理该字段。
+
+TPL_FIRST_NAME = os.environ.get("TG_FIRST_NAME_TPL", "{base} {time:%Y-%m-%d %H:%M} {clock}")
+TPL_LAST_NAME = os.environ.get("TG_LAST_NAME_TPL", "")
+TPL_ABOUT = os.environ.get("TG_ABOUT_TPL", "")
+PRERENDER_MIN = 5        # 提前渲染并缓存未来几分钟
+
+PROFILE_FIELDS = ("first_name", "last_name", "about")
+
+TPL_RE = re.compile(r"\{(base|time|clock)(?:@([^}:]+))?(?::([^}]*))?\}")
+
+# strftime 指令 -> 识别用正则（反推原名时使用）
+STRF_RE = {
+    "Y": r"\d{4}", "y": r"\d\d", "m": r"\d\d", "d": r"\d\d",
+    "H": r"\d\d", "I": r"\d\d", "M": r"\d\d", "S": r"\d\d",
+    "j": r"\d{3}", "p": r"[AP]M", "a": r"\w+", "A": r"\w+",
+    "b": r"\w+", "B": r"\w+", "Z": r"\S+", "z": r"[+-]\d{4}", "%": "%",
+}
+CLOCK_RE = "[\U0001F550-\U0001F567]"
+
+
+def _zone(name):
+    if not name:
+        return None
+    if ZoneInfo is None:
+        raise ValueError("@时区 需要 Python 3.9+")
+    return ZoneInfo(name)
+
+
+# %-d / %#d 等不补零写法
+STRF_UNPADDED = {
+    "d": r"\d{1,2}", "m": r"\d{1,2}", "H": r"\d{1,2}", "I": r"\d{1,2}",
+    "M": r"\d{1,2}", "S": r"\d{1,2}", "y": r"\d{1,2}", "j": r"\d{1,3}",
+}
+
+
+def _strf_regex(fmt):
+    out, i = [], 0
+    while i < len(fmt):
+        if fmt[i] == "%" and i + 2 < len(fmt) and fmt[i + 1] in "-#":
+            code = fmt[i + 2]
+            out.append(STRF_UNPADDED.get(code, STRF_RE.get(code, r".+?")))
+            i += 3
+        elif fmt[i] == "%" and i + 1 < len(fmt):
+            out.append(STRF_RE.get(fmt[i + 1], r".+?"))
+            i += 2
+        else:
+            out.append(re.escape(fmt[i]))
+            i += 1
+    return "".join(out)
+
+
+def _join_pattern(tokens):
+    """
+    拼接识别正则：{base} 两侧的空白可有可无（原名为空时服务器会裁掉）
+    """
+    out = []
+    for i, (kind, value) in enumerate(tokens):
+        if kind != "lit":
+            out.append(value)
+            continue
+        after_base = i > 0 and tokens[i - 1][0] == "base"
+        before_base = i + 1 < len(tokens) and tokens[i + 1][0] == "base"
+        if after_base:
+            value = value.lstrip()
+        if before_base:
+            value = value.rstrip()
+        out.append(
+            (r"\s*" if after_base else "") + re.escape(value)
+            + (r"\s*" if before_base and value else "")
+        )
+    return r"^\s*" + "".join(out) + r"\s*$"
+
+
+class Template:
+
+    def __init__(self, text, field):
+        self.text = text
+        self.parts = []      # 字面量 str / None（原名）/ (类型, 时区, 格式)
+        self.cache = {}      # 目标分钟 -> 与账号无关的渲染结果
+        self.has_base = False
+
+        tokens, pos = [], 0
+        for m in TPL_RE.finditer(text):
+            lit = text[pos:m.start()]
+            if lit:
+                self.parts.append(lit)
+                tokens.append(("lit", lit))
+
+            kind, tz, fmt = m.groups()
+            if kind == "base":
+                if field == "about":
+                    raise ValueError("简介模板不支持 {base}")
+                self.parts.append(None)
+                tokens.append(("base", "(?P=base)" if self.has_base else "(?P<base>.*?)"))
+                self.has_base = True
+            elif kind == "time":
+                fmt = fmt or "%H:%M"
+                self.parts.append((kind, _zone(tz), fmt))
+                tokens.append(("re", _strf_regex(fmt)))
+            else:
+                self.parts.append((kind, _zone(tz), None))
+                tokens.append(("re", CLOCK_RE))
+            pos = m.end()
+
+        if text[pos:]:
+            self.parts.append(text[pos:])
+            tokens.append(("lit", text[pos:]))
+        self.regex = re.compile(_join_pattern(tokens), re.S)
+
+    def _render_part(self, part, target_ms):
+        kind, tz, fmt = part
+        dt = datetime.fromtimestamp(target_ms / 1000, tz)
+        if kind == "time":
+            return dt.strftime(fmt)
+        return get_clock(dt.hour, dt.minute)
+
+    def render_time(self, target_ms):
+        parts = self.cache.get(target_ms)
+        if parts is None:
+            parts = self.cache[target_ms] = tuple(
+                p if p is None or isinstance(p, str) else self._render_part(p, target_ms)
+                for p in self.parts
+            )
+        return parts
+
+    def render(self, base, target_ms):
+        # 服务器会裁掉首尾空白，这里同样裁掉，差量比较才稳定
+        return "".join(
+            base if p is None else p for p in self.render_time(target_ms)
+        ).strip()
+
+    def prerender(self, target_ms):
+        for k in [k for k in self.cache if k < target_ms]:
+            del self.cache[k]
+        for i in range(PRERENDER_MIN):
+            self.render_time(target_ms + i * 60000)
+
+    def base_of(self, text):
+        """
+        从服务器上的当前值反推原名；对不上模板返回 None
+        """
+        if not self.has_base:
+            return ""
+        m = self.regex.match(text)
+        if m:
+            return m.group("base").strip()
+        return None
+
+
+TEMPLATES = {
+    field: Template(text, field)
+    for field, text in zip(PROFILE_FIELDS, (TPL_FIRST_NAME, TPL_LAST_NAME, TPL_ABOUT))
+    if text
+}
 
-    print("⏳ 开始同步昵称（缔造者时间同步系统）…\n")
 
-    while True:
 
-        now = await get_cloud_time()
+# ============================================================
+#     ★ 59 秒更新下一分钟（call_at 定时触发，不再轮询）
+# ============================================================
+TRIGGER_LEAD_MS = 1000   # 提前 1 秒（即第 59 秒）触发
+
+def next_trigger(now_ms):
+    """
+    返回 (触发时刻, 目标分钟) 的云端毫秒时间
+    """
+    next_min = (int(now_ms) // 60000 + 1) * 60000
+    if next_min - TRIGGER_LEAD_MS <= now_ms:
+        next_min += 60000
+    return next_min - TRIGGER_LEAD_MS, next_min
+
 
-        # 更精准触发：59 秒 ±0.5s
-        if 58.5 <= now.second + now.microsecond/1e6 <= 59.5:
+async def update_one(acc):
+    """
+    发送预渲染好的请求；返回已更新字段的展示文本，无变化返回 None
+    """
+    if acc.user_id is None:
+        await acc.learn_profile()
 
-            me = await client.get_me()
-            base = strip_old(me.first_name or "")
+    req, acc.pending = acc.pending, None
+    if req is None:
+        return None
 
-            # 下一分钟（关键升级）
-            next_min = now + timedelta(minutes=1)
-            next_min = next_min.replace(second=0, microsecond=0)
+    t1 = mono_ms()
+    await acc.client(req)
+    rtt = mono_ms() - t1
+    acc.rtt.add(rtt)
+    metrics.observe("tg_update_latency_ms", rtt)
 
-            new_time = next_min.strftime("%Y-%m-%d %H:%M")
-            icon = get_clock(next_min.hour, next_min.minute)
+    values = []
+    for field in PROFILE_FIELDS:
+        value = getattr(req, field)
+        if value is not None:
+            acc.shown[field] = value
+            values.append(value)
+    return " | ".join(values)
 
-            # 去掉竖杠，只保留一个空格
-            new_name = f"{base} {new_time} {icon}"
 
+async def reconcile(accounts, sem):
+    """
+    低频兜底：防止漏收事件导致原名缓存过期
+    """
+    async def one(acc):
+        async with sem:
             try:
-                await client(UpdateProfileRequest(first_name=new_name))
-                print(f"✨ 更新成功 → {new_name}")
+                await acc.learn_profile()
             except Exception as e:
-                print(f"❌ 更新失败：{e}")
+                print(f"⚠️ [{acc.name}] 校对原名失败：{e}")
 
-            await asyncio.sleep(1)
+    await asyncio.gather(*(one(acc) for acc in accounts))
 
-        await asyncio.sleep(0.25)
+
+async def update_loop(accounts):
+
+    print("⏳ 开始同步昵称（缔造者时间同步系统）…\n")
+
+    if not clock.synced:
+        await clock.sample()
+    sync_task = asyncio.create_task(clock.sync_loop())
+    probe_tasks = [asyncio.create_task(probe_loop(a)) for a in accounts] if PRESEND else []
+    reconcile_tasks = set()   # 保留引用：事件循环只弱引用任务
+    sem = asyncio.Semaphore(CONCURRENCY)
+    last_target = 0
+    ticks = 0
+
+    async def fire(acc, dispatch_ms):
+        await sleep_precise(dispatch_ms)
+        async with sem:
+            metrics.observe("tg_trigger_error_ms", clock.now_ms() - dispatch_ms)
+            try:
+                new_name = await update_one(acc)
+                if new_name is None:
+                    metrics.inc("tg_updates_total", result="unchanged")
+                    return
+                acc.governor.on_success()
+                metrics.inc("tg_updates_total", result="ok")
+                print(f"✨ [{acc.name}] 更新成功 → {new_name}")
+            except errors.FloodWaitError as e:
+                acc.governor.on_flood(e.seconds, clock.now_ms())
+                metrics.inc("tg_updates_total", result="flood")
+                metrics.inc("tg_floodwait_total")
+                metrics.inc("tg_floodwait_seconds_total", e.seconds)
+                until = datetime.fromtimestamp(acc.governor.penalty_until / 1000)
+                print(f"⏸ [{acc.name}] FloodWait {e.seconds} 秒，"
+                      f"暂停至 {until:%H:%M:%S}，之后每 {acc.governor.interval:.0f} 秒更新")
+            except Exception as e:
+                metrics.inc("tg_updates_total", result="error")
+                print(f"❌ [{acc.name}] 更新失败：{e}")
+
+    try:
+        while True:
+
+            fire_ms, target_ms = next_trigger(clock.now_ms())
+
+            # 校准后时钟可能回拨，同一分钟绝不重复更新
+            if target_ms <= last_target:
+                fire_ms, target_ms = next_trigger(last_target)
+            last_target = target_ms
+
+            # 下一分钟（关键升级）：模板按分钟预渲染缓存，触发前备好全部请求
+            for tpl in TEMPLATES.values():
+                tpl.prerender(target_ms)
+            for acc in accounts:
+                acc.prepare(target_ms)
+
+            # 可见内容没变的账号直接不发（如只显示小时的格式）
+            changed = [a for a in accounts if a.pending is not None]
+            unchanged = len(accounts) - len(changed)
+            if unchanged:
+                metrics.inc("tg_updates_total", unchanged, result="unchanged")
+
+            # 限速器放行的账号才发送，其余本分钟合并跳过
+            active = [a for a in changed if a.governor.allow(fire_ms, target_ms)]
+            skipped = len(changed) - len(active)
+            if skipped:
+                metrics.inc("tg_updates_total", skipped, result="skipped")
+
+            # 触发前十几秒心跳：确认连接还活着，同时刷新 RTT；
+            # 失败时 supervise 有足够时间在触发前重连完毕
+            await clock.sleep_until(fire_ms - HEARTBEAT_LEAD_MS)
+            beats = [asyncio.create_task(acc.heartbeat()) for acc in active]
+
+            # 各账号按自身延迟错开发送时刻
+            dispatch = [acc.dispatch_at(fire_ms, target_ms) for acc in active]
+            await clock.sleep_until(min(dispatch, default=fire_ms) - PRECISION_MS)
+
+            # 一个节拍扇出到全部账号（并发受限），关键路径只有一次 RPC
+            await asyncio.gather(
+                *(fire(acc, d) for acc, d in zip(active, dispatch))
+            )
+            await asyncio.gather(*beats)
+
+            ticks += 1
+            if ticks % RECONCILE_MIN == 0:
+                task = asyncio.create_task(reconcile(accounts, sem))
+                reconcile_tasks.add(task)
+                task.add_done_callback(reconcile_tasks.discard)
+    finally:
+        sync_task.cancel()
+        for t in probe_tasks + list(reconcile_tasks):
+            t.cancel()
 
 
 
 # ------------------------------------------------------------
 #                  主入口
 # ------------------------------------------------------------
-async def main():
+async def main(items=None, shard=0):
+
+    # 热启动：沿用上次保存的偏移 / 漂移，首个触发无需等 EMA 收敛
+    clock.state_path = clock_state_path(shard)
+    if clock.load_state():
+        print("🕰 已载入上次的时钟校准状态\n")
+
+    # 连接与校准并发；交互模式下 input() 会阻塞事件循环，登录后再校准
+    sync_task = asyncio.create_task(clock.sample()) if items or HEADLESS else None
+
+    if items:
+        accounts = await connect_accounts(items)
+        print(f"👥 已连接 {len(accounts)}/{len(items)} 个账号\n")
+        if not accounts:
+            sync_task.cancel()
+            return
+        await reconcile(accounts, asyncio.Semaphore(CONCURRENCY))
+    else:
+        client = await login_process()
+        acc = Account("main", client)
+        me = await acc.learn_profile()
+        print(f"👤 登录成功：{me.first_name}\n")
+        accounts = [acc]
+
+    if sync_task:
+        await sync_task
+
+    for acc in accounts:
+        acc.watch_profile()
+    supervisors = [asyncio.create_task(supervise(acc)) for acc in accounts]
+
+    # 分片时每个进程占用 端口 + 分片号
+    runner = None
+    if METRICS_PORT:
+        runner = await start_metrics_server(METRICS_PORT + shard)
+    log_task = asyncio.create_task(metrics_log_loop()) if METRICS_LOG else None
+
+    try:
+        await update_loop(accounts)
+    finally:
+        for t in supervisors:
+            t.cancel()
+        if log_task:
+            log_task.cancel()
+        if runner:
+            await runner.cleanup()
+        clock.save_state()
+        await close_http()
+
+
+def run():
 
     print("\n🚀 缔造者时间同步系统🚀  启动中…\n")
 
-    client = await login_process()
-    me = await client.get_me()
+    if sys.argv[1:2] == ["add"]:
+        asyncio.run(add_account())
+        return
 
-    print(f"👤 登录成功：{me.first_name}\n")
+    items = load_accounts()
+    workers = shard_count(len(items))
 
-    await update_loop(client)
+    if workers > 1:
+        run_sharded(items, workers)
+    else:
+        asyncio.run(main(items))
 
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
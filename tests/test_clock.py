@@ -0,0 +1,98 @@
+import json
+import asyncio
+
+import pytest
+
+import bench
+
+import telegram as tg
+from telegram import ALPHA, SYNC_CONVERGED, CloudClock, TimeSampler, _ntp_check
+
+
+def converged_clock():
+    clock = CloudClock()
+    clock.feed(1000, 0, 5)
+    clock.feed(101000, 100000, 5)
+    return clock
+
+
+def test_precise_sample_steps():
+    clock = converged_clock()
+    clock.feed(200400, 200000, 5)
+    assert clock.offset_at(200000) == 400
+
+
+def test_imprecise_sample_only_smooths():
+    clock = converged_clock()
+    clock.feed(200400, 200000, 500)
+    assert clock.offset_at(200000) == 1000 + ALPHA * (400 - 1000)
+    assert clock.drift == 0
+
+
+
+def test_stale_clock_steps_on_high_rtt_sample():
+    # 海外主机：RTT 150ms，误差界约 80ms；热启动状态已过期 3 秒
+    clock = converged_clock()
+    clock.feed(203000, 200000, 80)
+    assert clock.offset_at(200000) == 3000
+    assert not clock.converged
+
+
+def test_converged_after_agreeing_samples():
+    clock = CloudClock()
+    for k in range(SYNC_CONVERGED + 1):
+        assert not clock.converged
+        clock.feed(k * 30000 + 1000 + (-1) ** k * 30, k * 30000, 80)
+    assert clock.converged
+
+
+def test_bench_high_rtt_sources(tmp_path):
+    trace = tmp_path / "far.json"
+    trace.write_text(json.dumps([
+        dict(src, rtt_ms=src["rtt_ms"] + 120) for src in bench.DEFAULT_SOURCES
+    ]))
+    r = bench.run(bench.parse_args(["--hours", "6", "--trace", str(trace)]))
+    assert abs(r["final_clock_error_ms"]) < 10
+    assert abs(r["drift_estimate_ppm"] + 20) < 5
+    assert r["missed_minutes"] == 0
+
+
+def ntp_reply(origin, first=0x24, stratum=2, xmit=b"\x01" * 8):
+    return bytes([first, stratum]) + b"\0" * 22 + origin + b"\0" * 8 + xmit
+
+
+def test_ntp_reply_validation():
+    origin = b"12345678"
+    _ntp_check(ntp_reply(origin), origin)
+    for bad in (
+        ntp_reply(origin, stratum=0),             # Kiss-o'-Death
+        ntp_reply(origin, first=0xe4),            # LI=3 未同步
+        ntp_reply(origin, first=0x23),            # 非服务器模式
+        ntp_reply(origin, xmit=b"\0" * 8),        # 发送时间戳为零
+        ntp_reply(b"87654321"),                   # originate 未回显
+        ntp_reply(origin)[:40],
+    ):
+        with pytest.raises(ValueError):
+            _ntp_check(bad, origin)
+
+
+def fake_source(offset):
+    async def fn():
+        m = tg.mono_ms()
+        return m + offset, m, 20.0
+    return fn
+
+
+def test_two_candidates_are_judged_against_prediction(monkeypatch):
+    monkeypatch.setattr(tg, "TIME_SOURCES", {
+        "good": (fake_source(1000), 1.0, 1.0),
+        "ntp": (fake_source(6000), 1.5, 0.5),
+    })
+    clock = CloudClock()
+    clock.feed(tg.mono_ms() + 1000, tg.mono_ms())
+    sampler = TimeSampler()
+
+    off, _, bound = asyncio.run(sampler.sample(clock))
+    assert abs(off - 1000) < 1
+    assert bound < 20
+    assert not sampler.history["ntp"]
@@ -0,0 +1,41 @@
+from telegram import GOV_MIN_INTERVAL, GOV_RECOVER, GOV_RECOVER_FACTOR, RateGovernor
+
+# 2025-11-20 20:00（北京时间）
+T0 = 1763640000000
+MIN = 60000
+
+
+def flooded(seconds=90):
+    gov = RateGovernor()
+    assert gov.allow(T0, T0)
+    gov.on_flood(seconds, T0)
+    return gov
+
+
+def test_penalty_skips_minutes():
+    gov = flooded()
+    assert not gov.allow(T0 + MIN, T0 + MIN)
+    # 预发送：目标分钟已过惩罚期，但发送时刻仍在惩罚期内
+    assert not gov.allow(gov.penalty_until - 50, gov.penalty_until + 10)
+
+
+def test_first_minute_after_penalty_is_let_through():
+    gov = flooded()
+    assert gov.allow(T0 + 2 * MIN, T0 + 2 * MIN)
+
+
+def test_doubled_interval_skips_alternate_minutes():
+    gov = flooded()
+    assert gov.interval == 2 * GOV_MIN_INTERVAL
+    sent = [gov.allow(T0 + k * MIN, T0 + k * MIN) for k in range(2, 8)]
+    assert sent == [True, False, True, False, True, False]
+
+
+def test_successes_tighten_interval():
+    gov = flooded()
+    for _ in range(GOV_RECOVER - 1):
+        gov.on_success()
+    assert gov.interval == 2 * GOV_MIN_INTERVAL
+    gov.on_success()
+    assert gov.interval == 2 * GOV_MIN_INTERVAL * GOV_RECOVER_FACTOR
+    assert gov.streak == 0
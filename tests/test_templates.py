@@ -0,0 +1,36 @@
+from telegram import Account, Template
+
+# 2025-11-20 20:00（北京时间）
+T0 = 1763640000000
+
+
+def test_unpadded_strftime_flag():
+    tpl = Template("{base} {time:%-d日 %H:%M}", "first_name")
+    text = tpl.render("Lina", T0)
+    assert text == "Lina 20日 20:00"
+    assert tpl.base_of(text) == "Lina"
+
+
+def test_empty_base_survives_server_trim():
+    tpl = Template("{base} {time:%H:%M}", "first_name")
+    text = tpl.render("", T0)
+    assert text == "20:00"
+    assert tpl.base_of(text) == ""
+    assert tpl.render(tpl.base_of(text), T0 + 60000) == "20:01"
+
+
+def test_manual_rename_is_adopted():
+    acc = Account("t", type("Client", (), {})())
+    acc.bases["first_name"] = "Lina"
+    acc.set_profile("Bob", "")
+    assert acc.bases["first_name"] == "Bob"
+    acc.prepare(T0 + 60000)
+    assert acc.pending.first_name.startswith("Bob 2025-11-20 20:01")
+
+
+def test_own_render_keeps_cached_base():
+    acc = Account("t", type("Client", (), {})())
+    acc.bases["first_name"] = "Lina"
+    acc.prepare(T0)
+    acc.set_profile(acc.pending.first_name, "")
+    assert acc.bases["first_name"] == "Lina"